@@ -2,51 +2,163 @@
 
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.colors import to_rgba_array
+from matplotlib.patches import Patch
+from matplotlib.ticker import FixedFormatter, FixedLocator
 from collections import OrderedDict
 import argparse
+import hashlib
+import mmap
 import time
 import os
+import re
+import threading
 import yaml
 
+try:
+    from yaml import CSafeLoader as _YamlLoader
+except ImportError:
+    from yaml import SafeLoader as _YamlLoader
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+if Observer is not None:
+
+    class _ChangeHandler(FileSystemEventHandler):
+        def __init__(self, filepaths, event):
+            super().__init__()
+            self.filepaths = set(filepaths)
+            self.event = event
+
+        def on_any_event(self, event):
+            paths = {event.src_path, getattr(event, "dest_path", None)}
+            if not self.filepaths.isdisjoint(paths):
+                self.event.set()
+
+
 class FileWatcher:
-    def __init__(self, filepaths):
+    """
+    Watches files for changes.
+
+    If `notify` is set and watchdog is installed, :meth:`wait` blocks on
+    native file system notifications; otherwise it falls back to sleeping
+    for `poll_interval` seconds.
+    """
+
+    def __init__(self, filepaths, poll_interval=1, notify=True):
         self.filepaths = [os.path.abspath(f) for f in filepaths]
-        self._mtime = [None] * len(self.filepaths)
+        self.poll_interval = poll_interval
+        self._keys = [None] * len(self.filepaths)
+        self._event = threading.Event()
+        self._observer = None
+        if notify and Observer is not None:
+            # watch the parent directories so that editors that save by
+            # writing a new file and renaming it over the old one are seen;
+            # resolve symlinks so that edits to a link's target are seen
+            realpaths = [os.path.realpath(f) for f in self.filepaths]
+            handler = _ChangeHandler(realpaths, self._event)
+            self._observer = Observer()
+            self._observer.daemon = True
+            for directory in set(map(os.path.dirname, realpaths)):
+                self._observer.schedule(handler, directory, recursive=False)
+            self._observer.start()
+
+    def wait(self):
+        """
+        Blocks until one of the files may have changed.
+        """
+        if self._observer is None:
+            time.sleep(self.poll_interval)
+        else:
+            self._event.wait()
+            self._event.clear()
 
     @property
     def has_changed(self):
-        out = [False] * len(self.filepaths)
+        changed = False
         for idx, filepath in enumerate(self.filepaths):
-            mtime = os.stat(filepath).st_mtime
-            out[idx] = mtime != self._mtime[idx]
-            self._mtime[idx] = mtime
-        return any(out)
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                # editors that save by rename can briefly remove a file we
+                # have already seen; a file that never existed is an error
+                if self._keys[idx] is None:
+                    raise
+                continue
+            key = (stat.st_mtime_ns, stat.st_size)
+            if key != self._keys[idx]:
+                self._keys[idx] = key
+                changed = True
+        return changed
 
-def parse_csv(filepath):
-    data = OrderedDict()
 
-    def maybe_to_num(val):
-        try:
-            return float(val)
-        except:
-            return val
-
-    with open(filepath, "r") as f:
-        current_section = None
-        for line in f.readlines():
-            line = line.strip()
-            if len(line) <= 1 or line.startswith("#"):
-                pass
-            elif line.startswith("*"):
-                current_section = line[1:].strip()
-                data[current_section] = []
-            else:
-                parts = line.split(",")
-                start, finish = parts[:2]
-                item = ",".join(parts[2:])
-                data[current_section].append(
-                    [maybe_to_num(start), maybe_to_num(finish), item]
-                )
+_SECTION_HEADER = re.compile(rb"^[ \t]*\*[ \t]*(\S.*)$", re.MULTILINE)
+
+
+def _to_num(val):
+    try:
+        return float(val)
+    except ValueError:
+        return val.decode("utf-8")
+
+
+def _parse_section(buf, pos, end):
+    rows = []
+    while pos < end:
+        eol = buf.find(b"\n", pos, end)
+        if eol == -1:
+            eol = end
+        line = buf[pos:eol].strip()
+        pos = eol + 1
+        if len(line) <= 1 or line.startswith(b"#"):
+            continue
+        parts = line.split(b",", 2)
+        start, finish = parts[:2]
+        item = parts[2].decode("utf-8") if len(parts) > 2 else ""
+        rows.append([_to_num(start), _to_num(finish), item])
+    return rows
+
+
+def parse_csv(filepath, cache=None):
+    """
+    Parses a sectioned CSV file into an ordered dictionary of sections.
+
+    :param filepath: Path to the sectioned CSV file.
+    :param cache: Optional dictionary mapping section digests to parsed rows.
+        Sections whose contents hash to a known digest are rebuilt from the
+        cache instead of being re-parsed, and the dictionary is updated in
+        place to hold only the sections of this file. The returned rows are
+        always fresh lists, so modifying them does not affect the cache.
+    """
+    data = OrderedDict()
+    digests = {}
+    with open(filepath, "rb") as f:
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    headers = list(_SECTION_HEADER.finditer(mm))
+                    for header, next_header in zip(headers, headers[1:] + [None]):
+                        end = len(mm) if next_header is None else next_header.start()
+                        title = header.group(1).strip().decode("utf-8")
+                        if cache is None:
+                            data[title] = _parse_section(mm, header.end(), end)
+                            continue
+                        with view[header.end() : end] as body:
+                            digest = hashlib.blake2b(body, digest_size=8).digest()
+                        rows = cache.get(digest)
+                        if rows is None:
+                            rows = tuple(
+                                map(tuple, _parse_section(mm, header.end(), end))
+                            )
+                        digests[digest] = rows
+                        data[title] = [list(row) for row in rows]
+    if cache is not None:
+        cache.clear()
+        cache.update(digests)
     return data
 
 
@@ -72,10 +184,12 @@ class Gantt(object):
     """
 
     def __init__(self, data, ax=None):
-        if isinstance(data, str):
-            data = parse_csv(data)
+        self._filepath = data if isinstance(data, str) else None
+        self._section_cache = {}
         self.data = data
         self._ax = ax
+        if self._filepath is not None:
+            self.reload()
 
         self.ytick_fontsize = 14
         self.xtick_fontsize = 14
@@ -83,62 +197,86 @@ class Gantt(object):
         self.legend_fontsize = 14
         self.colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
 
+    def reload(self):
+        """
+        Re-reads the CSV file this chart was created from. Only sections whose
+        contents changed since the last read are parsed again.
+        """
+        if self._filepath is None:
+            raise ValueError(
+                "Only a Gantt chart created from a CSV filepath can be reloaded."
+            )
+        self.data = parse_csv(self._filepath, cache=self._section_cache)
+
     @property
     def ax(self):
         return plt.gca() if self._ax is None else self._ax
 
-    def _plot_bar(self, ypos, start, finish, color):
+    def _plot_bars(self, starts, finishes, colors):
         return self.ax.barh(
-            ypos,
-            finish - start,
-            left=start,
+            np.arange(starts.size),
+            finishes - starts,
+            left=starts,
             height=0.5,
             align="center",
-            color=color,
+            color=colors,
             alpha=0.7,
         )
 
     def plot(self):
-        ylabels = []
-        colors = iter(self.colors)
-        legend_items = OrderedDict()
-        for section_title, section in self.data.items():
-            color = next(colors)
-            for start, finish, item in section:
-                handle = self._plot_bar(len(ylabels), start, finish, color)
-                ylabels.append(item)
-                legend_items[section_title] = handle
+        sections = list(self.data.values())
+        section_lens = [len(section) for section in sections]
+        starts = np.fromiter(
+            (start for section in sections for start, _, _ in section), dtype=float
+        )
+        finishes = np.fromiter(
+            (finish for section in sections for _, finish, _ in section), dtype=float
+        )
+        ylabels = [item for section in sections for _, _, item in section]
+        section_colors = self.colors[: len(sections)]
+        colors = np.repeat(to_rgba_array(section_colors), section_lens, axis=0)
+        self._plot_bars(starts, finishes, colors)
+        legend_items = [
+            Patch(facecolor=color, alpha=0.7, label=section_title)
+            for section_title, color, section_len in zip(
+                self.data.keys(), section_colors, section_lens
+            )
+            if section_len > 0
+        ]
         # x-axis
         self.ax.xaxis.label.set_size(self.xlabel_fontsize)
         plt.setp(self.ax.get_xticklabels(), fontsize=self.xtick_fontsize)
         self.ax.grid(which="major", axis="x", linestyle="--", alpha=0.5)
 
-        # y-axis
-        self.ax.set_yticks(range(len(ylabels)))
-        self.ax.set_yticklabels(
-            ylabels,
-            fontdict={
-                "fontsize": self.ytick_fontsize,
-                "verticalalignment": "center",
-                "horizontalalignment": "right",
-            },
+        # y-axis; when rows are packed tighter than the label font size,
+        # only label every stride-th row so the labels do not overlap
+        label_height = self.ytick_fontsize * self.ax.figure.dpi / 72
+        axis_height = max(self.ax.get_window_extent().height, 1)
+        stride = max(1, int(np.ceil(len(ylabels) * label_height / axis_height)))
+        self.ax.yaxis.set_major_locator(
+            FixedLocator(np.arange(0, len(ylabels), stride))
+        )
+        self.ax.yaxis.set_major_formatter(FixedFormatter(ylabels[::stride]))
+        self.ax.tick_params(axis="y", labelsize=self.ytick_fontsize)
+        plt.setp(
+            self.ax.get_yticklabels(),
+            verticalalignment="center",
+            horizontalalignment="right",
         )
         self.ax.invert_yaxis()
 
         # legend
-        plt.legend(
-            legend_items.values(), legend_items.keys(), fontsize=self.legend_fontsize
-        )
+        self.ax.legend(handles=legend_items, fontsize=self.legend_fontsize)
 
         # remove frame
         for spine in self.ax.spines.values():
             spine.set_visible(False)
-        plt.tick_params(top=False, bottom=False, left=False, right=False)
+        self.ax.tick_params(top=False, bottom=False, left=False, right=False)
 
 
 parser = argparse.ArgumentParser(prog="pygantt")
 parser.add_argument("file", help="Path to sectioned CSV file.")
-parser.add_argument("-c", "--continuous", default=False, help="Whether to keep the program alive and look for file changes every second.", action="store_true")
+parser.add_argument("-c", "--continuous", default=False, help="Whether to keep the program alive and replot when the files change.", action="store_true")
 parser.add_argument("-o", "--output", default="gantt.png", help="Output filename.")
 parser.add_argument("--width", default=10, help="Width of output in inches.")
 parser.add_argument("--height", default=4, help="Height of output in inches.")
@@ -152,22 +290,26 @@ parser.add_argument("--conf", default="conf.yaml", help="Config YAML file specif
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    plt.switch_backend("Agg")
     watch = [args.file]
 
     has_conf = os.path.exists(args.conf)
+    known_options = set(vars(args))
     def update_conf():
         if has_conf:
             with open(args.conf, "r") as f:
-                conf = yaml.load(f)
+                conf = yaml.load(f, Loader=_YamlLoader) or {}
             for option, value in conf.items():
                 option = option.replace("-", "_")
-                if not hasattr(args, option):
+                if option not in known_options:
                     print("Warning: Unknown option {}".format(option))
-                setattr(args, option.replace("-", "_"), value)
+                setattr(args, option, value)
     if has_conf:
         watch += [args.conf]
 
-    file_watcher = FileWatcher(watch)
+    file_watcher = FileWatcher(watch, notify=args.continuous)
+    fig, ax = plt.subplots()
+    g = None
 
     while True:
         if file_watcher.has_changed:
@@ -176,17 +318,21 @@ if __name__ == "__main__":
                 update_conf()
 
             print("Parsing {}...".format(args.file))
-            g = Gantt(args.file)
+            if g is None:
+                g = Gantt(args.file, ax=ax)
+            else:
+                g.reload()
 
             print("Plotting figure...")
-            fig = plt.figure(figsize=(float(args.width), float(args.height)))
+            fig.set_size_inches(float(args.width), float(args.height))
+            ax.cla()
             g.xtick_fontsize = int(args.xtick_fontsize)
             g.ytick_fontsize = int(args.ytick_fontsize)
             g.xlabel_fontsize = int(args.xlabel_fontsize)
             g.legend_fontsize = int(args.legend_fontsize)
             g.plot()
-            plt.xticks(np.arange(0, g.ax.get_xlim()[1], int(args.tick_major)))
-            plt.xlabel(args.xlabel)
+            ax.set_xticks(np.arange(0, ax.get_xlim()[1], int(args.tick_major)))
+            ax.set_xlabel(args.xlabel)
             fig.tight_layout()
 
             print("Saving to {}...".format(args.output))
@@ -196,6 +342,6 @@ if __name__ == "__main__":
                 print("Waiting for changes...")
             else:
                 break
-        time.sleep(1)
+        file_watcher.wait()
 
     print("Done.")